@@ -11,10 +11,19 @@ import re
 import math
 import ast
 import operator
+import hashlib
+import time
+import zlib
+import functools
+import copy
+from collections import deque
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from types import SimpleNamespace
+from sqlalchemy import create_engine, event, inspect, select, Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
 from cryptography.fernet import Fernet
 import json
@@ -32,6 +41,129 @@ def get_encryption_key():
 
 cipher_suite = Fernet(get_encryption_key())
 
+@functools.lru_cache(maxsize=512)
+def _decrypt_cached(token):
+    """Decrypt a Fernet token, caching the plaintext by ciphertext"""
+    # Every encryption yields a fresh token (random IV), so a rewritten value
+    # never collides with a cached one and entries can't go stale.
+    return cipher_suite.decrypt(token).decode()
+
+def _decrypt_message(value):
+    """Decrypt a stored chat message"""
+    if value is not None:
+        try:
+            return _decrypt_cached(value)
+        except Exception:
+            return "[Decryption Error]"
+    return ""
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL journaling so each commit doesn't force a full fsync"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+class UnsafeExpression(ValueError):
+    """Expression uses syntax the calculator refuses to evaluate"""
+
+class _NodeHandlers(dict):
+    """Node type -> evaluator table; unknown node types raise instead of KeyError"""
+    
+    def __missing__(self, node_type):
+        raise ValueError(f"Unsupported AST node: {node_type.__name__}")
+
+# Syntax that is never allowed in a calculator expression
+_FORBIDDEN_NODES = frozenset({
+    ast.Import, ast.ImportFrom, ast.Attribute,
+    ast.Subscript, ast.ListComp, ast.DictComp,
+    ast.SetComp, ast.GeneratorExp, ast.Lambda,
+    ast.Dict, ast.List, ast.Set, ast.Tuple,
+})
+
+class _ExpressionValidator:
+    """Reject forbidden syntax, and calls and constants that could never evaluate"""
+    
+    def __init__(self, function_names, max_number):
+        self.function_names = function_names
+        self.max_number = max_number
+        # Node type -> check, run during the same walk as the forbidden-node test
+        self._checks = {
+            ast.Call: self._check_call,
+            ast.Constant: self._check_constant,
+        }
+    
+    def validate(self, tree):
+        """Check every node in one iterative walk, so deep nesting can't overflow the stack"""
+        checks = self._checks
+        error = None
+        for node in ast.walk(tree):
+            node_type = type(node)
+            if node_type in _FORBIDDEN_NODES:
+                raise UnsafeExpression("Unsupported operation")
+            if error is None:
+                check = checks.get(node_type)
+                if check is not None:
+                    try:
+                        check(node)
+                    except ValueError as e:
+                        # Keep walking: forbidden syntax wins over these errors
+                        error = e
+        if error is not None:
+            raise error
+    
+    def _check_call(self, node):
+        if not isinstance(node.func, ast.Name):
+            raise ValueError("Invalid function call")
+        if node.func.id not in self.function_names:
+            raise ValueError(f"Unknown function: {node.func.id}")
+        if node.keywords:
+            raise ValueError("Keyword arguments not supported")
+    
+    def _check_constant(self, node):
+        if not isinstance(node.value, (int, float)):
+            raise ValueError("Invalid constant type")
+        if abs(node.value) > self.max_number:
+            raise ValueError("Number too large")
+
+@functools.lru_cache(maxsize=256)
+def _parse_and_validate(expr, validator):
+    """Parse a normalized expression and reject invalid syntax, caching the tree"""
+    try:
+        tree = ast.parse(expr, mode='eval')
+    except RecursionError:
+        raise ValueError("Expression too deeply nested")
+    validator.validate(tree)
+    return tree
+
+# Shown by the calculator's help command
+_MATH_HELP_TEXT = (
+    "🧮 **Mathematical Calculator Help**\n\n"
+    "**Basic Operations:**\n"
+    "• Addition: 5 + 3\n"
+    "• Subtraction: 10 - 4\n" 
+    "• Multiplication: 6 * 7 (or 6×7)\n"
+    "• Division: 15 / 3 (or 15÷3)\n"
+    "• Power: 2^3 or 2**3\n"
+    "• Modulo: 17 % 5\n\n"
+    "**Advanced Functions:**\n"
+    "• Square root: sqrt(25)\n"
+    "• Trigonometry: sin(pi/2), cos(0), tan(pi/4)\n"
+    "• Logarithms: log(10), log10(100)\n"
+    "• Exponential: exp(1)\n"
+    "• Factorial: factorial(5)\n"
+    "• Rounding: round(3.14159, 2), floor(4.8), ceil(4.1)\n\n"
+    "**Constants:**\n"
+    "• pi = 3.14159...\n"
+    "• e = 2.71828...\n\n"
+    "**Examples:**\n"
+    "• sqrt(16) + 5\n"
+    "• sin(pi/6) * 2\n"
+    "• log10(1000) + factorial(4)\n"
+    "• (2^3 + 4) * sqrt(9)"
+)
+
 class MathCalculator:
     """Secure mathematical calculation engine using AST parsing"""
     
@@ -84,9 +216,43 @@ class MathCalculator:
         # Maximum input length to prevent DoS
         self.MAX_INPUT_LENGTH = 1000
         self.MAX_NUMBER = 10**10  # Reasonable limits
+        
+        # Static checks run once per parsed expression rather than per evaluation
+        self._validator = _ExpressionValidator(frozenset(self.functions), self.MAX_NUMBER)
+        
+        # AST node handlers for _safe_eval, looked up by exact node type.
+        # Handlers recurse through this table directly, so nesting costs one
+        # Python frame per level rather than two.
+        self._dispatch = _NodeHandlers({
+            ast.Expression: self._eval_expression,
+            ast.Constant: self._eval_constant,
+            ast.Name: self._eval_name,
+            ast.BinOp: self._eval_binop,
+            ast.UnaryOp: self._eval_unaryop,
+            ast.Call: self._eval_call,
+        })
+        
+        # Precompiled pre-check patterns; names match as substrings, case-insensitively
+        self._number_re = re.compile(r'\d')
+        self._operator_re = re.compile(r'[+\-*/^%()]')
+        self._function_re = re.compile('|'.join(map(re.escape, self.functions)), re.IGNORECASE)
+        self._constant_re = re.compile('|'.join(map(re.escape, self.constants)), re.IGNORECASE)
+        # Signed decimal literals that Python would parse to a plain number
+        self._literal_re = re.compile(
+            r'[+-]?(?:0|[1-9]\d*|(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+)'
+        )
+        self._float_literal_re = re.compile(r'[.eE]')
+        
+        # Math symbols to Python syntax, applied in a single pass
+        self._symbol_table = str.maketrans({
+            '^': '**',   # Power operator
+            '×': '*',    # Multiplication symbol
+            '÷': '/',    # Division symbol
+            '√': 'sqrt', # Square root symbol
+        })
     
-    def is_math_expression(self, text):
-        """Check if text contains a mathematical expression by attempting safe parsing"""
+    def _looks_like_math(self, text):
+        """Cheap check for mathematical indicators before any parsing"""
         if not text or len(text) > self.MAX_INPUT_LENGTH:
             return False
             
@@ -97,118 +263,119 @@ class MathCalculator:
             return False
             
         # Must have mathematical indicators
-        has_numbers = bool(re.search(r'\d', text))
-        has_operators = bool(re.search(r'[+\-*/^%()\*\*]', text))  # Removed dot
-        has_functions = any(func in text.lower() for func in self.functions.keys())
-        has_constants = any(const in text.lower() for const in self.constants.keys())
+        has_numbers = self._number_re.search(text) is not None
+        has_operators = self._operator_re.search(text) is not None
+        has_functions = self._function_re.search(text) is not None
+        has_constants = self._constant_re.search(text) is not None
         
-        if not ((has_numbers or has_constants) and (has_operators or has_functions)):
+        return (has_numbers or has_constants) and (has_operators or has_functions)
+    
+    def is_math_expression(self, text):
+        """Check if text contains a mathematical expression by attempting safe parsing"""
+        if not self._looks_like_math(text):
             return False
         
         # Test if it can be parsed as a valid math expression
         try:
-            expr = text.replace('^', '**').replace('×', '*').replace('÷', '/').replace('√', 'sqrt')
-            tree = ast.parse(expr, mode='eval')
-            
-            # Check for forbidden nodes
-            for node in ast.walk(tree):
-                if isinstance(node, (ast.Import, ast.ImportFrom, ast.Attribute, 
-                                   ast.Subscript, ast.ListComp, ast.DictComp, 
-                                   ast.SetComp, ast.GeneratorExp, ast.Lambda,
-                                   ast.Dict, ast.List, ast.Set, ast.Tuple)):
-                    return False
-            
+            _parse_and_validate(self._normalize(text.strip()), self._validator)
             return True
-        except (SyntaxError, ValueError):
+        except (SyntaxError, UnsafeExpression):
             return False
+        except ValueError:
+            # Math-shaped but invalid, e.g. an unknown function; calculate reports it
+            return True
+    
+    def try_calculate(self, text):
+        """Calculate text if it is a math expression, otherwise return None"""
+        if not self._looks_like_math(text):
+            return None
+        
+        try:
+            tree = _parse_and_validate(self._normalize(text.strip()), self._validator)
+        except (SyntaxError, UnsafeExpression):
+            return None
+        except ValueError as e:
+            return f"Math Error: {str(e)}"
+        return self._evaluate(tree)
+    
+    def _normalize(self, expr):
+        """Replace common math symbols with their Python equivalents"""
+        return expr.translate(self._symbol_table)
     
     def _safe_eval(self, node):
         """Safely evaluate an AST node"""
-        if isinstance(node, ast.Expression):
-            return self._safe_eval(node.body)
-        elif isinstance(node, ast.Constant):  # Python 3.8+
-            if isinstance(node.value, (int, float)):
-                if abs(node.value) > self.MAX_NUMBER:
-                    raise ValueError("Number too large")
-                return node.value
-            else:
-                raise ValueError("Invalid constant type")
-        elif isinstance(node, ast.Num):  # Python < 3.8
-            if abs(node.n) > self.MAX_NUMBER:
-                raise ValueError("Number too large")
-            return node.n
-        elif isinstance(node, ast.Name):
-            if node.id in self.constants:
-                return self.constants[node.id]
-            else:
-                raise ValueError(f"Unknown variable: {node.id}")
-        elif isinstance(node, ast.BinOp):
-            left = self._safe_eval(node.left)
-            right = self._safe_eval(node.right)
-            op = self.operators.get(type(node.op))
-            if op is None:
-                raise ValueError(f"Unsupported operation: {type(node.op).__name__}")
-            
-            # Special handling for division by zero and power limits
-            if isinstance(node.op, ast.Div) and right == 0:
-                raise ValueError("Division by zero")
-            if isinstance(node.op, ast.Pow) and abs(right) > 100:
-                raise ValueError("Power exponent too large")
-                
-            result = op(left, right)
-            if abs(result) > self.MAX_NUMBER:
-                raise ValueError("Result too large")
-            return result
-        elif isinstance(node, ast.UnaryOp):
-            operand = self._safe_eval(node.operand)
-            op = self.operators.get(type(node.op))
-            if op is None:
-                raise ValueError(f"Unsupported unary operation: {type(node.op).__name__}")
-            return op(operand)
-        elif isinstance(node, ast.Call):
-            if not isinstance(node.func, ast.Name):
-                raise ValueError("Invalid function call")
-            func_name = node.func.id
-            if func_name not in self.functions:
-                raise ValueError(f"Unknown function: {func_name}")
-            
-            args = [self._safe_eval(arg) for arg in node.args]
-            
-            # Special handling to prevent DoS attacks
-            if func_name == 'factorial':
-                if len(args) != 1 or not isinstance(args[0], int) or args[0] < 0 or args[0] > 100:
-                    raise ValueError("Factorial argument must be a non-negative integer ≤ 100")
-            elif func_name == 'pow':
-                if len(args) == 2:  # pow(base, exponent)
-                    base, exponent = args
-                    if abs(base) > self.MAX_NUMBER or abs(exponent) > 100:
-                        raise ValueError("Power base/exponent too large")
-                elif len(args) == 3:  # pow(base, exponent, modulus)
-                    base, exponent, modulus = args
-                    if abs(base) > self.MAX_NUMBER or abs(modulus) > self.MAX_NUMBER:
-                        raise ValueError("Power arguments too large")
-                    if abs(exponent) > 10000:  # Allow larger exponents for modular pow
-                        raise ValueError("Power exponent too large")
-                else:
-                    raise ValueError("pow() takes 2 or 3 arguments")
-            elif func_name in ('round', 'min', 'max'):
-                if len(args) == 0:
-                    raise ValueError(f"{func_name}() requires at least 1 argument")
-                # Allow these functions but check argument bounds
-                for arg in args:
-                    if isinstance(arg, (int, float)) and abs(arg) > self.MAX_NUMBER:
-                        raise ValueError("Argument too large")
-            
-            # Handle keyword arguments (currently not supported)
-            if node.keywords:
-                raise ValueError("Keyword arguments not supported")
-            
-            result = self.functions[func_name](*args)
-            if isinstance(result, (int, float)) and abs(result) > self.MAX_NUMBER:
-                raise ValueError("Function result too large")
-            return result
+        return self._dispatch[type(node)](node)
+    
+    def _eval_expression(self, node):
+        return self._dispatch[type(node.body)](node.body)
+    
+    def _eval_constant(self, node):
+        # Type and size were checked by _ExpressionValidator
+        return node.value
+    
+    def _eval_name(self, node):
+        if node.id in self.constants:
+            return self.constants[node.id]
         else:
-            raise ValueError(f"Unsupported AST node: {type(node).__name__}")
+            raise ValueError(f"Unknown variable: {node.id}")
+    
+    def _eval_binop(self, node):
+        left = self._dispatch[type(node.left)](node.left)
+        right = self._dispatch[type(node.right)](node.right)
+        op = self.operators.get(type(node.op))
+        if op is None:
+            raise ValueError(f"Unsupported operation: {type(node.op).__name__}")
+        
+        # Special handling for division by zero and power limits
+        if isinstance(node.op, ast.Div) and right == 0:
+            raise ValueError("Division by zero")
+        if isinstance(node.op, ast.Pow) and abs(right) > 100:
+            raise ValueError("Power exponent too large")
+            
+        result = op(left, right)
+        if abs(result) > self.MAX_NUMBER:
+            raise ValueError("Result too large")
+        return result
+    
+    def _eval_unaryop(self, node):
+        operand = self._dispatch[type(node.operand)](node.operand)
+        op = self.operators.get(type(node.op))
+        if op is None:
+            raise ValueError(f"Unsupported unary operation: {type(node.op).__name__}")
+        return op(operand)
+    
+    def _eval_call(self, node):
+        # Function name and keywords were checked by _ExpressionValidator
+        func_name = node.func.id
+        args = [self._dispatch[type(arg)](arg) for arg in node.args]
+        
+        # Special handling to prevent DoS attacks
+        if func_name == 'factorial':
+            if len(args) != 1 or not isinstance(args[0], int) or args[0] < 0 or args[0] > 100:
+                raise ValueError("Factorial argument must be a non-negative integer ≤ 100")
+        elif func_name == 'pow':
+            if len(args) == 2:  # pow(base, exponent)
+                base, exponent = args
+                if abs(base) > self.MAX_NUMBER or abs(exponent) > 100:
+                    raise ValueError("Power base/exponent too large")
+            elif len(args) == 3:  # pow(base, exponent, modulus)
+                base, exponent, modulus = args
+                if abs(base) > self.MAX_NUMBER or abs(modulus) > self.MAX_NUMBER:
+                    raise ValueError("Power arguments too large")
+                if abs(exponent) > 10000:  # Allow larger exponents for modular pow
+                    raise ValueError("Power exponent too large")
+            else:
+                raise ValueError("pow() takes 2 or 3 arguments")
+        elif func_name in ('round', 'min', 'max'):
+            # Arguments are already bounded: constants, operation results and
+            # function results are all capped at MAX_NUMBER
+            if len(args) == 0:
+                raise ValueError(f"{func_name}() requires at least 1 argument")
+        
+        result = self.functions[func_name](*args)
+        if isinstance(result, (int, float)) and abs(result) > self.MAX_NUMBER:
+            raise ValueError("Function result too large")
+        return result
     
     def calculate(self, expression):
         """Safely calculate mathematical expressions using AST parsing"""
@@ -216,76 +383,67 @@ class MathCalculator:
             if not expression or len(expression) > self.MAX_INPUT_LENGTH:
                 return "Error: Expression too long or empty"
             
-            # Clean the expression
-            expr = expression.strip()
+            # Clean the expression and replace common symbols
+            expr = self._normalize(expression.strip())
             
-            # Replace common symbols
-            expr = expr.replace('^', '**')  # Power operator
-            expr = expr.replace('×', '*')   # Multiplication symbol
-            expr = expr.replace('÷', '/')   # Division symbol
-            expr = expr.replace('√', 'sqrt') # Square root symbol
+            # Bare numbers need no parsing or tree walk
+            if self._literal_re.fullmatch(expr):
+                value = float(expr) if self._float_literal_re.search(expr) else int(expr)
+                if abs(value) > self.MAX_NUMBER:
+                    raise ValueError("Number too large")
+                return self._format_result(value)
             
-            # Parse the expression into an AST
+            # Parse the expression into an AST and check for dangerous nodes
             try:
-                tree = ast.parse(expr, mode='eval')
+                tree = _parse_and_validate(expr, self._validator)
             except SyntaxError as e:
                 return f"Syntax Error: {str(e)}"
+            except UnsafeExpression:
+                return "Error: Unsupported operation"
             
-            # Check for dangerous nodes
-            for node in ast.walk(tree):
-                if isinstance(node, (ast.Import, ast.ImportFrom, ast.Attribute, 
-                                   ast.Subscript, ast.ListComp, ast.DictComp, 
-                                   ast.SetComp, ast.GeneratorExp, ast.Lambda,
-                                   ast.Dict, ast.List, ast.Set, ast.Tuple)):
-                    return "Error: Unsupported operation"
-            
-            # Evaluate safely
-            result = self._safe_eval(tree)
-            
-            # Format result nicely
-            if isinstance(result, float):
-                if math.isnan(result):
-                    return "Error: Result is not a number"
-                elif math.isinf(result):
-                    return "Error: Result is infinite"
-                elif result.is_integer():
-                    return str(int(result))
-                else:
-                    return f"{result:.10g}"  # Remove trailing zeros
-            return str(result)
+            return self._evaluate(tree)
             
         except ValueError as e:
             return f"Math Error: {str(e)}"
         except Exception as e:
             return f"Calculation Error: {str(e)}"
     
+    def _evaluate(self, tree):
+        """Safely evaluate a validated expression tree and format the result"""
+        try:
+            return self._format_result(self._safe_eval(tree))
+        except ValueError as e:
+            return f"Math Error: {str(e)}"
+        except RecursionError:
+            # Nesting deeper than the interpreter stack allows (e.g. when called
+            # from an already deep stack); the parse-time checks are iterative
+            return "Math Error: Expression too deeply nested"
+        except Exception as e:
+            return f"Calculation Error: {str(e)}"
+    
+    def _format_result(self, result):
+        """Format a numeric result for display"""
+        if isinstance(result, float):
+            if math.isnan(result):
+                return "Error: Result is not a number"
+            elif math.isinf(result):
+                return "Error: Result is infinite"
+            elif result.is_integer():
+                return str(int(result))
+            else:
+                return f"{result:.10g}"  # Remove trailing zeros
+        return str(result)
+    
     def get_math_help(self):
         """Return help text for mathematical operations"""
-        return (
-            "🧮 **Mathematical Calculator Help**\n\n"
-            "**Basic Operations:**\n"
-            "• Addition: 5 + 3\n"
-            "• Subtraction: 10 - 4\n" 
-            "• Multiplication: 6 * 7 (or 6×7)\n"
-            "• Division: 15 / 3 (or 15÷3)\n"
-            "• Power: 2^3 or 2**3\n"
-            "• Modulo: 17 % 5\n\n"
-            "**Advanced Functions:**\n"
-            "• Square root: sqrt(25)\n"
-            "• Trigonometry: sin(pi/2), cos(0), tan(pi/4)\n"
-            "• Logarithms: log(10), log10(100)\n"
-            "• Exponential: exp(1)\n"
-            "• Factorial: factorial(5)\n"
-            "• Rounding: round(3.14159, 2), floor(4.8), ceil(4.1)\n\n"
-            "**Constants:**\n"
-            "• pi = 3.14159...\n"
-            "• e = 2.71828...\n\n"
-            "**Examples:**\n"
-            "• sqrt(16) + 5\n"
-            "• sin(pi/6) * 2\n"
-            "• log10(1000) + factorial(4)\n"
-            "• (2^3 + 4) * sqrt(9)"
-        )
+        return _MATH_HELP_TEXT
+
+# Longer inputs are rejected before any key-derivation work is done
+MAX_PASSWORD_LENGTH = 1024
+
+# Werkzeug hash method for new passwords, e.g. "scrypt" or "pbkdf2:sha256:600000".
+# Stored hashes record their own method, so existing ones keep verifying.
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
 
 class User(Base):
     """User model with local authentication"""
@@ -308,11 +466,11 @@ class User(Base):
     def set_password(self, password):
         """Set password hash"""
         if password:
-            self.password_hash = generate_password_hash(password)
+            self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
     
     def check_password(self, password):
         """Check password against hash"""
-        if password and self.password_hash is not None:
+        if password and len(password) <= MAX_PASSWORD_LENGTH and self.password_hash is not None:
             return check_password_hash(str(self.password_hash), password)
         return False
     
@@ -336,16 +494,30 @@ class UserPreferences(Base):
     # Relationships
     user = relationship('User', back_populates='preferences')
     
+    def _load_preferences(self):
+        """Return the decrypted preferences dict, decrypting only when the stored value changes"""
+        encrypted = self._preferences_data
+        cached = self.__dict__.get('_prefs_cache')
+        if cached is not None and cached[0] == encrypted:
+            return cached[1]
+        
+        data = {}
+        if encrypted is not None:
+            try:
+                decrypted = _decrypt_cached(encrypted)
+                data = json.loads(decrypted)
+            except Exception:
+                data = {}
+        # Not a mapped attribute; lives alongside SQLAlchemy's instance state
+        self.__dict__['_prefs_cache'] = (encrypted, data)
+        return data
+    
     @property
     def preferences_data(self):
         """Decrypt and return preferences data"""
-        if self._preferences_data is not None:
-            try:
-                decrypted = cipher_suite.decrypt(str(self._preferences_data).encode()).decode()
-                return json.loads(decrypted)
-            except Exception:
-                return {}
-        return {}
+        # Deep copy: nested values such as topics_of_interest must not be
+        # shared with the cache, or mutating them would bypass encryption
+        return copy.deepcopy(self._load_preferences())
     
     @preferences_data.setter
     def preferences_data(self, value):
@@ -354,12 +526,14 @@ class UserPreferences(Base):
             json_str = json.dumps(value)
             encrypted = cipher_suite.encrypt(json_str.encode()).decode()
             self._preferences_data = encrypted
+            self.__dict__['_prefs_cache'] = (encrypted, copy.deepcopy(value))
         else:
             self._preferences_data = None
+            self.__dict__['_prefs_cache'] = (None, {})
     
     def get_preference(self, key, default=None):
         """Get a specific preference value"""
-        return self.preferences_data.get(key, default)
+        return copy.deepcopy(self._load_preferences().get(key, default))
     
     def set_preference(self, key, value):
         """Set a specific preference value"""
@@ -381,7 +555,12 @@ class ChatHistory(Base):
     
     # Metadata
     conversation_id = Column(String(36), nullable=False, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    
+    # Serves "latest N for a user" as a range scan with no sort
+    __table_args__ = (
+        Index('ix_chat_history_user_id_timestamp', 'user_id', 'timestamp'),
+    )
     
     # Relationships
     user = relationship('User', back_populates='chat_history')
@@ -389,12 +568,7 @@ class ChatHistory(Base):
     @property
     def user_message(self):
         """Decrypt and return user message"""
-        if self._user_message is not None:
-            try:
-                return cipher_suite.decrypt(str(self._user_message).encode()).decode()
-            except Exception:
-                return "[Decryption Error]"
-        return ""
+        return _decrypt_message(self._user_message)
     
     @user_message.setter
     def user_message(self, value):
@@ -406,12 +580,7 @@ class ChatHistory(Base):
     @property
     def bot_response(self):
         """Decrypt and return bot response"""
-        if self._bot_response is not None:
-            try:
-                return cipher_suite.decrypt(str(self._bot_response).encode()).decode()
-            except Exception:
-                return "[Decryption Error]"
-        return ""
+        return _decrypt_message(self._bot_response)
     
     @bot_response.setter
     def bot_response(self, value):
@@ -420,10 +589,46 @@ class ChatHistory(Base):
             encrypted = cipher_suite.encrypt(value.encode()).decode()
             self._bot_response = encrypted
     
+    @classmethod
+    def recent_turns(cls, session, user_id, limit):
+        """Return the latest turns as plaintext, most recent first, loading only the message columns"""
+        rows = session.execute(
+            select(cls._user_message, cls._bot_response)
+            .where(cls.user_id == user_id)
+            .order_by(cls.timestamp.desc())
+            .limit(limit)
+        ).all()
+        return [
+            SimpleNamespace(
+                user_message=_decrypt_message(user_message),
+                bot_response=_decrypt_message(bot_response)
+            )
+            for user_message, bot_response in rows
+        ]
+    
+    @classmethod
+    def recent_rows(cls, session, user_id, limit):
+        """Return (timestamp, user ciphertext, bot ciphertext) rows, most recent first"""
+        # Left encrypted so callers can decrypt only the rows they show
+        return session.execute(
+            select(cls.timestamp, cls._user_message, cls._bot_response)
+            .where(cls.user_id == user_id)
+            .order_by(cls.timestamp.desc())
+            .limit(limit)
+        ).all()
+    
+    @staticmethod
+    def decrypt(value):
+        """Decrypt a stored message column value from recent_rows"""
+        return _decrypt_message(value)
+    
     def __repr__(self):
         return f'<ChatHistory User:{self.user_id} at {self.timestamp}>'
 
 # Gemini AI integration
+# Lighter models (e.g. gemini-2.5-flash-lite) trade some quality for latency
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+
 try:
     from google import genai
     from google.genai import types
@@ -443,12 +648,36 @@ except ImportError:
     types = None
     print("Warning: Gemini not available. Using fallback responses.")
 
+@functools.lru_cache(maxsize=16)
+def _context_prefix(style, interests):
+    """Build the preference-derived part of the chat context"""
+    parts = [f"Be {style} and direct in your responses."]
+    if interests:
+        parts.append(f"User interests: {', '.join(interests)}.")
+    return " ".join(parts)
+
 class ChatbotEngine:
     """Gemini AI chatbot engine with memory and personalization"""
     
+    # Generic demo-mode replies, formatted only when one is actually chosen
+    FALLBACK_TEMPLATES = (
+        "Hi {name}! I'm currently running in demo mode. In the full version, I would use a local LLM to provide intelligent responses to your message: '{message}'",
+        "Hello {name}! I understand you said: '{message}'. I'm designed to remember our conversation and your preferences for personalized responses.",
+        "Thanks for your message, {name}! While I'm in demo mode, I would normally analyze your message and provide contextual responses based on our chat history.",
+    )
+    
+    # Fixed part of the chat system instruction, appended after the per-message context
+    CHAT_INSTRUCTION = "Provide helpful, accurate, and direct responses. If the user asks for mathematical calculations, perform them accurately."
+    
     def __init__(self):
         self.ready = GEMINI_AVAILABLE and gemini_client is not None
         self.math_calculator = MathCalculator()
+        
+        # Recent Gemini replies for short, repeated messages ("hi", "help")
+        self._response_cache = {}  # key -> (response, timestamp)
+        self.RESPONSE_CACHE_SIZE = 512
+        self.RESPONSE_CACHE_TTL = 600  # seconds
+        self.RESPONSE_CACHE_MAX_MESSAGE = 64  # longer messages are not cached
         if self.ready:
             print("Gemini AI ready for fast responses!")
         print("🧮 Mathematical calculator ready!")
@@ -459,46 +688,106 @@ class ChatbotEngine:
     
     def generate_response(self, message, user_context=None, conversation_history=None):
         """Generate chatbot response using Gemini API with math calculation support"""
-        # Check for mathematical expressions first
-        if self.math_calculator.is_math_expression(message):
-            result = self.math_calculator.calculate(message)
-            name = user_context.get("display_name", "there") if user_context else "there"
-            return f"🧮 {name}, the answer is: **{result}**"
+        # Same path as the streaming reply, so caching and fallbacks can't drift apart
+        return "".join(self.generate_response_stream(
+            message,
+            user_context=user_context,
+            conversation_history=conversation_history
+        )).strip()
+    
+    def generate_response_stream(self, message, user_context=None, conversation_history=None):
+        """Yield the chatbot response in chunks as Gemini produces them"""
+        math_reply = self._math_response(message, user_context)
+        if math_reply is not None:
+            yield math_reply
+            return
         
-        if not self.ready or not gemini_client:
-            return self._get_fallback_response(message, user_context)
+        if not self.ready or not gemini_client or not types:
+            yield self._get_fallback_response(message, user_context)
+            return
         
+        context = self._build_context(user_context, conversation_history)
+        cache_key = self._response_cache_key(context, message)
+        cached = self._get_cached_response(cache_key)
+        if cached:
+            yield cached
+            return
+        
+        chunks = []
         try:
-            # Build context for better responses
-            context = self._build_context(user_context, conversation_history)
-            
-            # Create system instruction for Gemini
-            system_instruction = f"{context}\n\nProvide helpful, accurate, and direct responses. If the user asks for mathematical calculations, perform them accurately."
-            
-            # Generate response using Gemini
-            if types:
-                response = gemini_client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=[
-                        types.Content(role="user", parts=[types.Part(text=message)])
-                    ],
-                    config=types.GenerateContentConfig(
-                        system_instruction=system_instruction,
-                        max_output_tokens=300,
-                        temperature=0.7
-                    )
-                )
-            else:
-                return self._get_fallback_response(message, user_context)
-            
-            if response and response.text:
-                return response.text.strip()
-            else:
-                return self._get_fallback_response(message, user_context)
-                
+            stream = gemini_client.models.generate_content_stream(
+                **self._chat_request(message, context)
+            )
+            for chunk in stream:
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield chunk.text
         except Exception as e:
-            print(f"Gemini API error: {e}")
-            return self._get_fallback_response(message, user_context)
+            print(f"\nGemini API error: {e}")
+            if chunks:
+                return  # Partial reply already shown; don't cache it
+        
+        if chunks:
+            self._cache_response(cache_key, "".join(chunks).strip())
+        else:
+            yield self._get_fallback_response(message, user_context)
+    
+    def _math_response(self, message, user_context):
+        """Answer a math expression directly, or return None for other messages"""
+        result = self.math_calculator.try_calculate(message)
+        if result is None:
+            return None
+        name = user_context.get("display_name", "there") if user_context else "there"
+        return f"🧮 {name}, the answer is: **{result}**"
+    
+    def _response_cache_key(self, context, message):
+        """Return the response cache key, or None if the message isn't cacheable"""
+        if len(message) >= self.RESPONSE_CACHE_MAX_MESSAGE:
+            return None
+        context_hash = hashlib.blake2b(context.encode(), digest_size=16).hexdigest()
+        return (context_hash, message)
+    
+    def _get_cached_response(self, key):
+        """Return a cached response that hasn't expired yet"""
+        if key is None:
+            return None
+        entry = self._response_cache.get(key)
+        if entry is None:
+            return None
+        response, cached_at = entry
+        if time.monotonic() - cached_at > self.RESPONSE_CACHE_TTL:
+            del self._response_cache[key]
+            return None
+        return response
+    
+    def _cache_response(self, key, response):
+        """Store a response, evicting the oldest entry when full"""
+        if key is None or not response:
+            return
+        if len(self._response_cache) >= self.RESPONSE_CACHE_SIZE:
+            self._response_cache.pop(next(iter(self._response_cache)))
+        self._response_cache[key] = (response, time.monotonic())
+    
+    def _chat_request(self, message, context):
+        """Build the Gemini request arguments for a chat message"""
+        # Create system instruction for Gemini; without context it is the same
+        # constant string on every request
+        if context:
+            system_instruction = f"{context}\n\n{self.CHAT_INSTRUCTION}"
+        else:
+            system_instruction = self.CHAT_INSTRUCTION
+        
+        return {
+            "model": GEMINI_MODEL,
+            "contents": [
+                types.Content(role="user", parts=[types.Part(text=message)])
+            ],
+            "config": types.GenerateContentConfig(
+                system_instruction=system_instruction,
+                max_output_tokens=300,
+                temperature=0.7
+            ),
+        }
     
     def _build_context(self, user_context, conversation_history):
         """Build context string from user data and history"""
@@ -506,12 +795,8 @@ class ChatbotEngine:
         
         if user_context:
             style = user_context.get("chat_style", "friendly")
-            interests = user_context.get("topics_of_interest", [])
-            
-            context_parts.append(f"Be {style} and direct in your responses.")
-            
-            if interests:
-                context_parts.append(f"User interests: {', '.join(interests)}.")
+            interests = tuple(user_context.get("topics_of_interest", []))
+            context_parts.append(_context_prefix(style, interests))
         
         # Minimal history context for continuity without repetition
         if conversation_history and len(conversation_history) > 0:
@@ -524,16 +809,8 @@ class ChatbotEngine:
         """Fallback responses when LLM is not available"""
         name = user_context.get("display_name", "there") if user_context else "there"
         
-        # Check for mathematical expressions first
-        if self.math_calculator.is_math_expression(message):
-            result = self.math_calculator.calculate(message)
-            return f"🧮 {name}, the answer is: **{result}**"
-        
-        fallback_responses = [
-            f"Hi {name}! I'm currently running in demo mode. In the full version, I would use a local LLM to provide intelligent responses to your message: '{message}'",
-            f"Hello {name}! I understand you said: '{message}'. I'm designed to remember our conversation and your preferences for personalized responses.",
-            f"Thanks for your message, {name}! While I'm in demo mode, I would normally analyze your message and provide contextual responses based on our chat history.",
-        ]
+        # Math expressions were already answered by generate_response_stream,
+        # the only caller, so the message isn't parsed a second time here
         
         # Simple keyword-based responses for demonstration
         message_lower = message.lower()
@@ -546,7 +823,9 @@ class ChatbotEngine:
         elif any(word in message_lower for word in ["math", "calculate", "calculator"]):
             return f"🧮 {name}! I can help with mathematical calculations. Try expressions like:\n• Basic: 15 + 27, 100 / 4, 2^8\n• Advanced: sqrt(144), sin(pi/2), log10(1000)\n• Or ask me for more math help!"
         else:
-            return fallback_responses[hash(message) % len(fallback_responses)]
+            # crc32 is cheap and, unlike hash(), stable across runs
+            index = zlib.crc32(message.encode('utf-8', 'ignore')) % len(self.FALLBACK_TEMPLATES)
+            return self.FALLBACK_TEMPLATES[index].format(name=name, message=message)
     
     def facilitate_convocation(self, topic, perspectives=None, user_context=None):
         """Facilitate group discussion by gathering multiple perspectives on a topic"""
@@ -635,7 +914,7 @@ class ChatbotEngine:
         try:
             if types:
                 response = gemini_client.models.generate_content(
-                    model="gemini-2.5-flash",
+                    model=GEMINI_MODEL,
                     contents=[
                         types.Content(role="user", parts=[types.Part(text=prompt)])
                     ],
@@ -677,14 +956,47 @@ class ChatbotEngine:
                    f"by impact, explain the reasoning behind recommendations, and provide both "
                    f"immediate steps and long-term strategies to help you succeed.")
 
+def _read_password(prompt):
+    """Read a password without echo on a terminal, or as a plain line from piped input"""
+    if not sys.stdin.isatty():
+        # getpass would warn and fall back to stdin anyway; skip the /dev/tty attempt
+        return input(prompt)
+    try:
+        # getpass already falls back to echoing input (with a GetPassWarning)
+        # when it can't turn echo off
+        return getpass.getpass(prompt)
+    except OSError:
+        # Terminal I/O failed outright; read the line with echo rather than crash
+        return input(prompt)
+
+# Valid preference values
+CHAT_STYLES = frozenset({'friendly', 'professional', 'humorous', 'concise', 'detailed'})
+RESPONSE_LENGTHS = frozenset({'short', 'medium', 'long'})
+
 class CLIChatbot:
     """Main CLI Chatbot Application"""
     
     def __init__(self):
         self.setup_database()
         self.current_user = None
+        self._user_context = {}  # current user's preferences, see _refresh_user_context
         self.chatbot_engine = ChatbotEngine()
         
+        # Menu choice -> handler; choices without a handler are returned to run()
+        self._auth_actions = {
+            '1': self.login,
+            '2': self.register,
+        }
+        self._main_actions = {
+            '1': self.start_chat,
+            '2': self.view_chat_history,
+            '3': self.calculator_session,
+            '4': self.convocation_session,
+            '5': self.negotiation_session,
+            '6': self.suggestion_session,
+            '7': self.manage_preferences,
+        }
+        
     def setup_database(self):
         """Initialize database connection and create tables"""
         database_url = os.environ.get('DATABASE_URL')
@@ -692,9 +1004,37 @@ class CLIChatbot:
             print("Warning: DATABASE_URL not found. Using SQLite.")
             database_url = 'sqlite:///chatbot.db'
         
-        self.engine = create_engine(database_url)
-        Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
+        is_sqlite = make_url(database_url).get_backend_name() == 'sqlite'
+        if is_sqlite:
+            self.engine = create_engine(database_url)
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        else:
+            # Keep a few server connections warm, drop dead ones before use and
+            # replace them before server-side idle timeouts close them
+            self.engine = create_engine(database_url, pool_size=5, max_overflow=10,
+                                        pool_pre_ping=True, pool_recycle=3600)
+        # One table listing instead of a per-table existence check on every launch
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        if not existing_tables.issuperset(Base.metadata.tables):
+            Base.metadata.create_all(self.engine)
+        elif is_sqlite:
+            # create_all skips existing tables, so add chat history indexes added
+            # since. Local SQLite files only: server databases may not grant DDL
+            # to the app role, so add indexes there by hand (see README).
+            existing_indexes = {index['name'] for index in inspector.get_indexes(ChatHistory.__tablename__)}
+            for index in ChatHistory.__table__.indexes:
+                if index.name not in existing_indexes:
+                    try:
+                        index.create(self.engine)
+                    except SQLAlchemyError as e:
+                        # Only a missing speedup; the app works without it
+                        print(f"Warning: could not create index {index.name}: {e}")
+        # Single-user CLI: nothing else writes these rows mid-session, so keep
+        # loaded objects valid across commits instead of re-SELECTing them.
+        # Since nothing is reloaded, attach new related rows through their
+        # relationship (e.g. user.preferences = ...) rather than only the FK.
+        Session = sessionmaker(bind=self.engine, expire_on_commit=False)
         self.session = Session()
     
     def run(self):
@@ -725,11 +1065,9 @@ class CLIChatbot:
         
         while True:
             choice = input("\nSelect option (1-3): ").strip()
-            if choice == '1':
-                self.login()
-                return choice
-            elif choice == '2':
-                self.register()
+            action = self._auth_actions.get(choice)
+            if action:
+                action()
                 return choice
             elif choice == '3':
                 return choice
@@ -753,26 +1091,9 @@ class CLIChatbot:
         
         while True:
             choice = input("\nSelect option (1-9): ").strip()
-            if choice == '1':
-                self.start_chat()
-                return choice
-            elif choice == '2':
-                self.view_chat_history()
-                return choice
-            elif choice == '3':
-                self.calculator_session()
-                return choice
-            elif choice == '4':
-                self.convocation_session()
-                return choice
-            elif choice == '5':
-                self.negotiation_session()
-                return choice
-            elif choice == '6':
-                self.suggestion_session()
-                return choice
-            elif choice == '7':
-                self.manage_preferences()
+            action = self._main_actions.get(choice)
+            if action:
+                action()
                 return choice
             elif choice in ['8', '9']:
                 return choice
@@ -787,16 +1108,20 @@ class CLIChatbot:
             print("Username cannot be empty.")
             return
         
-        password = getpass.getpass("Password: ")
+        password = _read_password("Password: ")
         if not password:
             print("Password cannot be empty.")
             return
         
-        user = self.session.query(User).filter_by(username=username).first()
+        # Load preferences in the same query; every session menu reads them
+        user = self.session.query(User)\
+            .options(joinedload(User.preferences))\
+            .filter_by(username=username).first()
         if user and user.check_password(password):
             self.current_user = user
             user.update_last_login()
             self.session.commit()
+            self._refresh_user_context()
             print(f"✅ Welcome back, {user.username}!")
         else:
             print("❌ Invalid username or password.")
@@ -824,12 +1149,15 @@ class CLIChatbot:
             print("❌ Email already registered.")
             return
         
-        password = getpass.getpass("Password (min 6 chars): ")
+        password = _read_password("Password (min 6 chars): ")
         if not password or len(password) < 6:
             print("❌ Password must be at least 6 characters.")
             return
+        if len(password) > MAX_PASSWORD_LENGTH:
+            print(f"❌ Password must be at most {MAX_PASSWORD_LENGTH} characters.")
+            return
         
-        confirm_password = getpass.getpass("Confirm Password: ")
+        confirm_password = _read_password("Confirm Password: ")
         if password != confirm_password:
             print("❌ Passwords do not match.")
             return
@@ -841,24 +1169,38 @@ class CLIChatbot:
         )
         user.set_password(password)
         
-        self.session.add(user)
-        self.session.flush()
-        
-        # Create default preferences  
-        preferences = UserPreferences(
-            user_id=user.id
-        )
+        # Create default preferences; the relationship fills in user_id when
+        # both rows are inserted by the commit
+        preferences = UserPreferences()
         preferences.preferences_data = {
             "display_name": username,
             "chat_style": "friendly",
             "topics_of_interest": [],
             "response_length": "medium"
         }
-        self.session.add(preferences)
-        self.session.commit()
+        user.preferences = preferences
+        
+        # The unique constraints are the real check: another process may have
+        # taken the username or email since the lookups above
+        try:
+            self.session.add(user)
+            self.session.commit()
+        except IntegrityError as e:
+            self.session.rollback()
+            if 'email' in str(e.orig):
+                print("❌ Email already registered.")
+            else:
+                print("❌ Username already exists.")
+            return
         
         print(f"✅ Account created successfully! Welcome, {username}!")
         self.current_user = user
+        self._refresh_user_context()
+    
+    def _refresh_user_context(self):
+        """Cache the current user's preferences for the session menus"""
+        prefs = self.current_user.preferences if self.current_user else None
+        self._user_context = prefs.preferences_data if prefs else {}
     
     def start_chat(self):
         """Start chat session"""
@@ -869,56 +1211,85 @@ class CLIChatbot:
         
         conversation_id = str(uuid.uuid4())
         
-        while True:
-            try:
-                if self.current_user is None:
-                    break
-                user_message = input(f"\n{self.current_user.username}: ").strip()
-                if not user_message:
-                    continue
-                
-                if user_message.lower() in ['quit', 'exit', 'q']:
-                    break
-                
-                # Get user preferences for personalization
-                user_prefs = self.current_user.preferences
-                user_context = user_prefs.preferences_data if user_prefs else {}
-                
-                # Get recent conversation history for context (limit to 3 for cleaner context)
-                recent_history = self.session.query(ChatHistory)\
-                    .filter_by(user_id=self.current_user.id)\
-                    .order_by(ChatHistory.timestamp.desc())\
-                    .limit(3).all()
-                
-                print("🤖 Generating response...")
-                
-                # Generate bot response with Gemini
-                bot_response = self.chatbot_engine.generate_response(
-                    user_message, 
-                    user_context=user_context,
-                    conversation_history=recent_history
-                )
-                
-                print(f"🤖 AI: {bot_response}")
-                
-                # Save to database with encryption
-                if self.current_user is None:
+        if self.current_user is None:
+            return
+        
+        # Recent turns for context (most recent first). Loaded once, then kept
+        # up to date in memory from the plaintext we already have each turn.
+        history = ChatHistory.recent_turns(self.session, self.current_user.id, limit=3)
+        recent_history = deque(history, maxlen=3)
+        
+        # Get user preferences for personalization
+        user_context = self._user_context
+        
+        # Turns are committed in batches rather than one transaction each.
+        # Trade-off: turns shown to the user are not durable until their batch
+        # commits, so a hard kill (or a failed commit) loses up to
+        # commit_every - 1 of them. Every normal exit, Ctrl+C and unexpected
+        # exceptions included, goes through the finally below.
+        commit_every = 5
+        pending_turns = 0
+        
+        try:
+            while True:
+                try:
+                    if self.current_user is None:
+                        break
+                    user_message = input(f"\n{self.current_user.username}: ").strip()
+                    if not user_message:
+                        continue
+                    
+                    if user_message.lower() in ['quit', 'exit', 'q']:
+                        break
+                    
+                    print("🤖 Generating response...")
+                    
+                    # Stream bot response from Gemini as it is generated
+                    print("🤖 AI: ", end="", flush=True)
+                    chunks = []
+                    for chunk in self.chatbot_engine.generate_response_stream(
+                        user_message, 
+                        user_context=user_context,
+                        conversation_history=list(recent_history)
+                    ):
+                        print(chunk, end="", flush=True)
+                        chunks.append(chunk)
+                    print()
+                    bot_response = "".join(chunks).strip()
+                    
+                    # Save to database with encryption
+                    if self.current_user is None:
+                        break
+                    # Stamp the turn now: the column default is applied at flush,
+                    # which only happens when the batch commits
+                    chat_entry = ChatHistory(
+                        user_id=self.current_user.id,
+                        conversation_id=conversation_id,
+                        timestamp=datetime.utcnow()
+                    )
+                    chat_entry.user_message = user_message
+                    chat_entry.bot_response = bot_response
+                    
+                    self.session.add(chat_entry)
+                    pending_turns += 1
+                    if pending_turns >= commit_every:
+                        self.session.commit()
+                        pending_turns = 0
+                    
+                    recent_history.appendleft(SimpleNamespace(
+                        user_message=user_message,
+                        bot_response=bot_response
+                    ))
+                    
+                except KeyboardInterrupt:
+                    print("\n\nChat session ended.")
                     break
-                chat_entry = ChatHistory(
-                    user_id=self.current_user.id,
-                    conversation_id=conversation_id
-                )
-                chat_entry.user_message = user_message
-                chat_entry.bot_response = bot_response
-                
-                self.session.add(chat_entry)
+                except Exception as e:
+                    print(f"❌ Error: {e}")
+        finally:
+            # Save any turns from the last partial batch
+            if pending_turns:
                 self.session.commit()
-                
-            except KeyboardInterrupt:
-                print("\n\nChat session ended.")
-                break
-            except Exception as e:
-                print(f"❌ Error: {e}")
     
     def view_chat_history(self):
         """View chat history"""
@@ -927,10 +1298,8 @@ class CLIChatbot:
         if self.current_user is None:
             print("No user logged in.")
             return
-        history = self.session.query(ChatHistory)\
-            .filter_by(user_id=self.current_user.id)\
-            .order_by(ChatHistory.timestamp.desc())\
-            .limit(20).all()
+        # Read-only display: plain rows, no ORM objects to track
+        history = ChatHistory.recent_rows(self.session, self.current_user.id, limit=20)
         
         if not history:
             print("No chat history found.")
@@ -939,10 +1308,19 @@ class CLIChatbot:
         print(f"Last 20 conversations (Total messages: {len(history)})")
         print("-" * 70)
         
-        for entry in reversed(history):  # Show oldest first
-            print(f"\n[{entry.timestamp.strftime('%Y-%m-%d %H:%M')}]")
-            print(f"You: {entry.user_message}")
-            print(f"AI:  {entry.bot_response}")
+        # Show oldest first, a page at a time; entries are only decrypted
+        # when their page is displayed
+        entries = list(reversed(history))
+        page_size = 5
+        for start in range(0, len(entries), page_size):
+            if start > 0:
+                more = input(f"\nPress Enter for more ({len(entries) - start} left), or 'q' to stop: ").strip().lower()
+                if more in ['q', 'quit']:
+                    return
+            for timestamp, user_message, bot_response in entries[start:start + page_size]:
+                print(f"\n[{timestamp.strftime('%Y-%m-%d %H:%M')}]")
+                print(f"You: {ChatHistory.decrypt(user_message)}")
+                print(f"AI:  {ChatHistory.decrypt(bot_response)}")
         
         input("\nPress Enter to continue...")
     
@@ -955,24 +1333,26 @@ class CLIChatbot:
             return
         prefs = self.current_user.preferences
         if not prefs:
-            prefs = UserPreferences(
-                user_id=self.current_user.id
-            )
+            prefs = UserPreferences()
             prefs.preferences_data = {
                 "display_name": str(self.current_user.username),
                 "chat_style": "friendly",
                 "topics_of_interest": [],
                 "response_length": "medium"
             }
-            self.session.add(prefs)
+            # Attach through the relationship: objects aren't expired on commit,
+            # so setting only user_id would leave current_user.preferences None
+            self.current_user.preferences = prefs
             self.session.commit()
         
         while True:
+            # One read per redraw instead of one per displayed preference
+            data = prefs.preferences_data
             print(f"\nCurrent Preferences:")
-            print(f"1. Display Name: {prefs.get_preference('display_name', self.current_user.username if self.current_user else 'User')}")
-            print(f"2. Chat Style: {prefs.get_preference('chat_style', 'friendly')}")
-            print(f"3. Response Length: {prefs.get_preference('response_length', 'medium')}")
-            print(f"4. Topics of Interest: {', '.join(prefs.get_preference('topics_of_interest', []))}")
+            print(f"1. Display Name: {data.get('display_name', self.current_user.username if self.current_user else 'User')}")
+            print(f"2. Chat Style: {data.get('chat_style', 'friendly')}")
+            print(f"3. Response Length: {data.get('response_length', 'medium')}")
+            print(f"4. Topics of Interest: {', '.join(data.get('topics_of_interest', []))}")
             print("5. Return to Main Menu")
             
             choice = input("\nSelect option to modify (1-5): ").strip()
@@ -987,7 +1367,7 @@ class CLIChatbot:
             elif choice == '2':
                 print("Chat Styles: friendly, professional, humorous, concise, detailed")
                 new_style = input("Enter chat style: ").strip().lower()
-                if new_style in ['friendly', 'professional', 'humorous', 'concise', 'detailed']:
+                if new_style in CHAT_STYLES:
                     prefs.set_preference('chat_style', new_style)
                     self.session.commit()
                     print("✅ Chat style updated!")
@@ -997,7 +1377,7 @@ class CLIChatbot:
             elif choice == '3':
                 print("Response Lengths: short, medium, long")
                 new_length = input("Enter response length: ").strip().lower()
-                if new_length in ['short', 'medium', 'long']:
+                if new_length in RESPONSE_LENGTHS:
                     prefs.set_preference('response_length', new_length)
                     self.session.commit()
                     print("✅ Response length updated!")
@@ -1018,6 +1398,9 @@ class CLIChatbot:
             
             else:
                 print("❌ Invalid choice.")
+        
+        # Other menus read the cached copy, so pick up any changes made here
+        self._refresh_user_context()
     
     def calculator_session(self):
         """Interactive mathematical calculator session"""
@@ -1091,8 +1474,7 @@ class CLIChatbot:
         print("\n🤖 Analyzing topic and preparing facilitation framework...")
         
         # Get user preferences for personalization
-        user_prefs = self.current_user.preferences
-        user_context = user_prefs.preferences_data if user_prefs else {}
+        user_context = self._user_context
         
         # Generate convocation response
         response = self.chatbot_engine.facilitate_convocation(
@@ -1140,8 +1522,7 @@ class CLIChatbot:
         print("\n🤖 Analyzing negotiation dynamics and generating strategies...")
         
         # Get user preferences for personalization
-        user_prefs = self.current_user.preferences
-        user_context = user_prefs.preferences_data if user_prefs else {}
+        user_context = self._user_context
         
         # Generate negotiation response
         response = self.chatbot_engine.assist_negotiation(
@@ -1192,8 +1573,7 @@ class CLIChatbot:
         print("\n🤖 Analyzing your challenge and generating practical suggestions...")
         
         # Get user preferences for personalization
-        user_prefs = self.current_user.preferences
-        user_context = user_prefs.preferences_data if user_prefs else {}
+        user_context = self._user_context
         
         # Generate suggestions response
         response = self.chatbot_engine.provide_suggestions(
@@ -1228,6 +1608,7 @@ class CLIChatbot:
             return
         username = self.current_user.username
         self.current_user = None
+        self._user_context = {}
         print(f"✅ Goodbye {username}! You have been logged out.")
 
 def main():